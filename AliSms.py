@@ -11,6 +11,7 @@ import json
 import requests
 
 from settings import *
+from circuit_breaker import get_breaker
 
 
 class AliyunSms(object):
@@ -67,13 +68,24 @@ class DingSms(object):
     content: message content
     contact_nums: list, contacts phone nums
     isAtAll: bool, true=at all, false=no
+    suppressor: alert_suppress.AlertSuppressor, 多进程间告警去重，窗口期内相同告警只发送一次
     """
 
-    def __init__(self, DingRobotUrl):
+    def __init__(self, DingRobotUrl, suppressor=None):
         self.url = DingRobotUrl
+        self.suppressor = suppressor
+        # 同一个机器人地址在进程内共享一个熔断器，熔断时抛出CircuitOpenError
+        self.breaker = get_breaker(DingRobotUrl)
         self.session = requests.session()
         self.session.headers.update({"Content-Type": "application/json"})
 
+    def _post(self, data):
+        """在熔断器内调用，5xx和无法解析的响应都抛出异常记为失败"""
+        r = self.session.post(self.url, data=json.dumps(data), timeout=5)
+        if r.status_code >= 500:
+            r.raise_for_status()
+        return json.loads(r.content)
+
     def send_text(self, content, contact_nums=None, isAtAll=False):
         data = {"msgtype": "text",
                 "text": {
@@ -83,8 +95,7 @@ class DingSms(object):
             data["at"] = {"atMobiles": contact_nums,
                           "isAtAll": isAtAll
                           }
-        r = self.session.post(self.url, data=json.dumps(data))
-        result = json.loads(r.content)
+        result = self.breaker.call(self._post, data)
         if result["errcode"] != 0:
             status = True
         else:
@@ -98,6 +109,13 @@ class DingSms(object):
         else:
             content = u"检测到发送告警失败，请立即查看..."
             content = u"报错信息: {0}".format(error_info)
+        fp = None
+        if self.suppressor is not None:
+            # 只有开启告警抑制时才需要alert_suppress(依赖pymongo)
+            from alert_suppress import fingerprint
+            fp = fingerprint(self.url, contact_nums or [], content)
+            if not self.suppressor.acquire(fp):
+                return False
         data = {"msgtype": "text",
                 "text": {
                     "content": content}
@@ -106,10 +124,18 @@ class DingSms(object):
             data["at"] = {"atMobiles": contact_nums,
                           "isAtAll": isAtAll
                           }
-        r = self.session.post(self.url, data=json.dumps(data))
-        result = json.loads(r.content)
+        try:
+            result = self.breaker.call(self._post, data)
+        except Exception:
+            # 没有发送成功，释放指纹让其他进程可以重新发送
+            if fp is not None:
+                self.suppressor.release(fp)
+            raise
         if result["errcode"] != 0:
             status = True
         else:
             status = False
+        # status为True表示发送失败(errcode != 0)，释放指纹让其他进程可以重新发送
+        if status and fp is not None:
+            self.suppressor.release(fp)
         return status
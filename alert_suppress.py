@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+# coding=utf-8
+"""
+@desc:   基于mongodb TTL集合的跨进程告警抑制(去重)
+         同一个告警指纹在一个窗口期内，所有进程/节点只会发送一次
+
+"""
+
+import time
+import hashlib
+import datetime
+import threading
+
+from pymongo.errors import DuplicateKeyError
+
+from mongo_tool import MongoConn
+
+
+try:
+    text_type = unicode
+except NameError:
+    text_type = str
+
+
+def _to_bytes(part):
+    if isinstance(part, bytes):
+        return part
+    if not isinstance(part, text_type):
+        part = text_type(part)
+    return part.encode("utf-8")
+
+
+def fingerprint(*parts):
+    """
+    desc: 根据告警的关键内容生成告警指纹，兼容python2的unicode内容
+    param: <parts> 参与计算指纹的内容，比如告警接收人、告警内容
+    return: 指纹字符串
+    """
+    md5 = hashlib.md5()
+    for part in parts:
+        if isinstance(part, (list, tuple)):
+            part = b",".join(sorted(_to_bytes(p) for p in part))
+        md5.update(_to_bytes(part))
+        md5.update(b"\x00")
+    return md5.hexdigest()
+
+
+class AlertSuppressor(object):
+    """
+    coll_name: db:coll 形式的集合名，集合上会建立 expire_at 的TTL索引
+    window: 抑制窗口，单位秒
+    cache_size: 进程内缓存的已抑制指纹个数上限
+    """
+
+    def __init__(self, coll_name="alert:suppress", window=300, conf=None, cache_size=10000):
+        self.window = window
+        self.cache_size = cache_size
+        self.conn = MongoConn(conf)
+        self.coll = self.conn.get_coll(coll_name)
+        # TTL索引: expire_at 到期后由mongodb后台删除，重复创建是幂等的
+        self.coll.create_index("expire_at", expireAfterSeconds=0)
+        # 进程内缓存 {fingerprint: 抑制到期的时间戳}，命中时不需要访问mongodb
+        self._cache = {}
+        self._lock = threading.Lock()
+
+    def _suppressed_locally(self, fp, now):
+        with self._lock:
+            until = self._cache.get(fp)
+            if until is None:
+                return False
+            if until > now:
+                return True
+            self._cache.pop(fp, None)
+            return False
+
+    def _remember(self, fp, until):
+        with self._lock:
+            if len(self._cache) >= self.cache_size:
+                now = time.time()
+                for key in [k for k, v in self._cache.items() if v <= now]:
+                    self._cache.pop(key)
+                if len(self._cache) >= self.cache_size:
+                    self._cache.clear()
+            self._cache[fp] = until
+
+    def acquire(self, fp, window=None):
+        """
+        desc: 尝试占用一个告警指纹
+        param: <fp> 告警指纹
+               <window> 本次使用的抑制窗口，默认使用实例的window
+        return: True 窗口期内第一次出现，需要发送
+                False 已被其他进程/节点发送过，需要抑制
+        """
+        window = window or self.window
+        now = time.time()
+        if self._suppressed_locally(fp, now):
+            return False
+
+        utc_now = datetime.datetime.utcnow()
+        expire_at = utc_now + datetime.timedelta(seconds=window)
+        try:
+            # 只有记录不存在或者已过期(TTL后台线程还没来得及删除)时才能匹配到，
+            # 记录未过期时匹配不到，upsert 插入同一个 _id 会触发 DuplicateKeyError
+            self.coll.find_one_and_update(
+                {"_id": fp, "expire_at": {"$lte": utc_now}},
+                {"$set": {"expire_at": expire_at, "sent_at": utc_now}},
+                upsert=True)
+        except DuplicateKeyError:
+            doc = self.coll.find_one({"_id": fp}, {"expire_at": 1})
+            if doc and doc.get("expire_at"):
+                left = (doc["expire_at"] - utc_now).total_seconds()
+                self._remember(fp, now + max(left, 0))
+            return False
+        self._remember(fp, now + window)
+        return True
+
+    def release(self, fp):
+        """
+        desc: 释放告警指纹，一般在发送失败时调用，让其他进程可以重新发送
+        """
+        with self._lock:
+            self._cache.pop(fp, None)
+        self.coll.delete_one({"_id": fp})
+
+    def close(self):
+        self.conn.close()
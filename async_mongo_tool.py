@@ -0,0 +1,154 @@
+#!/usr/bin/env python
+# coding=utf-8
+"""
+@desc:   MongoConn的asyncio版本，基于motor
+         集合命名与MongoConn一致，支持 db:coll 的写法
+
+"""
+
+import weakref
+import asyncio
+
+from pymongo import UpdateMany
+from motor.motor_asyncio import AsyncIOMotorClient
+
+
+class AsyncMongoConn(object):
+    """
+    for mongodb with asyncio
+    同一个事件循环内相同uri的连接共享一个client(连接池)，client在第一次使用时按当前运行的事件循环创建，
+    所以choose_db/get_coll等方法需要在协程中调用
+    """
+    sep = ":"
+    # {事件循环: {uri: client}}
+    clients = weakref.WeakKeyDictionary()
+
+    def __init__(self, conf=None, max_pool_size=100):
+        #uri = 'mongodb://{username}:{password}@{host}:{port}/'.format(**conf)
+        self.uri = 'mongodb://localhost:27017'
+        self.max_pool_size = max_pool_size
+        self._client = None
+        self.db = None
+        self.coll = None
+
+    @property
+    def client(self):
+        if self._client is None:
+            loop = asyncio.get_running_loop()
+            clients = AsyncMongoConn.clients.get(loop)
+            if clients is None:
+                # client持有事件循环的引用，已经关闭的事件循环需要主动清理
+                AsyncMongoConn._close_clients(lambda l: l.is_closed())
+                clients = AsyncMongoConn.clients.setdefault(loop, {})
+            if self.uri not in clients:
+                clients[self.uri] = AsyncIOMotorClient(self.uri, maxPoolSize=self.max_pool_size, io_loop=loop)
+            self._client = clients[self.uri]
+        return self._client
+
+    def close(self):
+        """只释放本实例的引用，共享的client由close_all关闭"""
+        self._client = None
+        self.db = None
+        self.coll = None
+
+    @classmethod
+    def close_all(cls, loop=None):
+        """
+        desc: 关闭共享的client
+        param: <loop> 只关闭这个事件循环的client，默认全部关闭
+        """
+        cls._close_clients(lambda l: loop is None or l is loop)
+
+    @classmethod
+    def _close_clients(cls, match):
+        for loop in [l for l in list(cls.clients.keys()) if match(l)]:
+            for client in cls.clients.pop(loop).values():
+                client.close()
+
+    def choose_db(self, db_name):
+        self.db = self.client[db_name]
+        return True
+
+    def choose_coll(self, coll_name):
+        if self.sep in coll_name:
+            db, coll_name = coll_name.split(self.sep)
+            if not self.choose_db(db):
+                return False
+        self.coll = self.db[coll_name]
+        return True
+
+    def get_db(self, db_name=None):
+        if db_name is not None:
+            return self.client[db_name]
+        return self.db
+
+    def get_coll(self, coll_name=None):
+        if coll_name is not None:
+            if self.sep in coll_name:
+                db_name, coll_name = coll_name.split(self.sep)
+                return self.client[db_name][coll_name]
+            return self.db[coll_name]
+        return self.coll
+
+    async def mset(self, coll_name, info, ordered=False):
+        """
+        desc: 插入一条或者多条记录
+        param: <info> dict 或者 list
+               <ordered> 批量插入时是否按顺序插入，False时mongodb可以并行写入
+        """
+        coll = self.get_coll(coll_name)
+        if isinstance(info, list):
+            try:
+                return await coll.insert_many(info, ordered=ordered)
+            except Exception as e:
+                raise ValueError(e)
+        elif isinstance(info, dict):
+            try:
+                return await coll.insert_one(info)
+            except Exception as e:
+                raise ValueError(e)
+        else:
+            raise Exception("It doesn't support this type of info")
+
+    async def mput(self, coll_name, old, new):
+        coll = self.get_coll(coll_name)
+        try:
+            return await coll.update_many(old, {"$set": new,
+                                                "$currentDate": {"lastModified": True}})
+        except Exception as e:
+            return e
+
+    async def mput_many(self, coll_name, updates, ordered=False):
+        """
+        desc: 批量更新，一次bulk_write发送
+        param: <updates> [(old, new),,,]，与mput的参数含义一致
+        """
+        coll = self.get_coll(coll_name)
+        requests = [UpdateMany(old, {"$set": new, "$currentDate": {"lastModified": True}})
+                    for old, new in updates]
+        if not requests:
+            return None
+        try:
+            return await coll.bulk_write(requests, ordered=ordered)
+        except Exception as e:
+            return e
+
+    async def find_batches(self, coll_name, *args, batch_size=1000, **kwargs):
+        """
+        desc: 按批次流式读取，find等其他集合方法与MongoConn一样直接委托给当前集合
+              async for docs in conn.find_batches("db:coll", {"status": 1}, batch_size=500):
+                  ...
+        param: <batch_size> 每批返回的记录数，同时作为游标每次从服务端取的数量
+        """
+        cursor = self.get_coll(coll_name).find(*args, **kwargs).batch_size(batch_size)
+        batch = []
+        async for doc in cursor:
+            batch.append(doc)
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def __getattr__(self, item, *args, **kwargs):
+        return getattr(self.coll, item, *args, **kwargs)
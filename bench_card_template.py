@@ -0,0 +1,52 @@
+#!/usr/bin/env python
+# coding=utf-8
+"""
+@desc:   对比每个用户重新构建卡片并json.dumps 与 CardTemplate 渲染的耗时
+         python bench_card_template.py [recipients]
+
+"""
+
+import sys
+import json
+import time
+
+from feishu_card import CardTemplate
+
+
+def build_card(name, app, count):
+    return {
+        "config": {"wide_screen_mode": True},
+        "header": {"title": {"tag": "plain_text", "content": "发布通知"}, "template": "blue"},
+        "elements": [
+            {"tag": "div", "text": {"tag": "lark_md", "content": "**%s** 你好" % name}},
+            {"tag": "div", "text": {"tag": "lark_md", "content": "应用: %s, 待处理审批 %s 条" % (app, count)}},
+            {"tag": "hr"},
+            {"tag": "action", "actions": [{"tag": "button", "text": {"tag": "plain_text", "content": "查看详情"},
+                                           "url": "https://example.com/approval", "type": "primary"}]},
+        ],
+    }
+
+
+def main(recipients=10000):
+    users = dict(("ou_%08d" % i, {"name": "user%d" % i, "app": "app%d" % (i % 50), "count": i % 7})
+                 for i in range(recipients))
+
+    start = time.time()
+    for open_id, values in users.items():
+        json.dumps({"open_id": open_id, "msg_type": "interactive",
+                    "card": build_card(values["name"], values["app"], values["count"])})
+    baseline = time.time() - start
+
+    start = time.time()
+    template = CardTemplate(build_card("${name}", "${app}", "${count}"))
+    for open_id, values in users.items():
+        '{"open_id": %s, "msg_type": "interactive", "card": %s}' % (json.dumps(open_id), template.render(values))
+    compiled = time.time() - start
+
+    print("recipients: %d" % recipients)
+    print("dict + json.dumps: %.3fs" % baseline)
+    print("CardTemplate:      %.3fs (x%.1f)" % (compiled, baseline / compiled if compiled else 0))
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 10000)
@@ -0,0 +1,151 @@
+#!/usr/bin/env python
+# coding=utf-8
+"""
+@desc:   熔断器，外部依赖(飞书、钉钉、smtp)不可用时快速失败，避免拖垮整个worker池
+         closed: 正常调用，统计最近的调用结果，失败率超过阈值后熔断
+         open: 直接抛出CircuitOpenError，等待reset_timeout秒后进入half_open
+         half_open: 只放行有限个探测请求，探测成功则恢复closed，失败则重新open
+
+"""
+
+import time
+import threading
+from collections import deque
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(Exception):
+    """熔断器打开时抛出的异常"""
+
+    def __init__(self, name, retry_after):
+        self.name = name
+        self.retry_after = retry_after
+        super(CircuitOpenError, self).__init__(
+            "circuit %s is open, retry after %.1fs" % (name, retry_after))
+
+
+class CircuitBreaker(object):
+    """
+    name: 熔断器名称，一般是接口地址
+    failure_rate: 失败率阈值，0~1
+    window: 统计最近多少次调用的结果
+    min_calls: 统计的调用次数少于这个值时不熔断
+    reset_timeout: 熔断后多少秒进入half_open
+    half_open_calls: half_open状态下最多同时放行的探测请求数
+    """
+
+    def __init__(self, name, failure_rate=0.5, window=20, min_calls=5, reset_timeout=30, half_open_calls=1):
+        self.name = name
+        self.failure_rate = failure_rate
+        self.min_calls = min_calls
+        self.reset_timeout = reset_timeout
+        self.half_open_calls = half_open_calls
+        self._results = deque(maxlen=window)
+        self._state = CLOSED
+        self._opened_at = 0
+        self._probing = 0
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        with self._lock:
+            if self._state == OPEN and time.time() - self._opened_at >= self.reset_timeout:
+                return HALF_OPEN
+            return self._state
+
+    def stats(self):
+        with self._lock:
+            calls = len(self._results)
+            failures = calls - sum(self._results)
+        return {"name": self.name, "state": self.state, "calls": calls, "failures": failures}
+
+    def before_call(self):
+        """调用前检查，熔断时抛出CircuitOpenError"""
+        with self._lock:
+            if self._state == OPEN:
+                left = self.reset_timeout - (time.time() - self._opened_at)
+                if left > 0:
+                    raise CircuitOpenError(self.name, left)
+                self._state = HALF_OPEN
+                self._probing = 0
+            if self._state == HALF_OPEN:
+                if self._probing >= self.half_open_calls:
+                    raise CircuitOpenError(self.name, 0)
+                self._probing += 1
+
+    def record_success(self):
+        with self._lock:
+            if self._state == HALF_OPEN:
+                self._state = CLOSED
+                self._results.clear()
+                self._probing = 0
+            self._results.append(True)
+
+    def record_failure(self):
+        with self._lock:
+            if self._state == HALF_OPEN:
+                self._trip()
+                return
+            self._results.append(False)
+            calls = len(self._results)
+            if calls >= self.min_calls and (calls - sum(self._results)) >= self.failure_rate * calls:
+                self._trip()
+
+    def release(self):
+        """调用被放弃(既不算成功也不算失败)时释放half_open的探测名额"""
+        with self._lock:
+            if self._state == HALF_OPEN and self._probing > 0:
+                self._probing -= 1
+
+    def _trip(self):
+        self._state = OPEN
+        self._opened_at = time.time()
+        self._probing = 0
+
+    def reset(self):
+        with self._lock:
+            self._state = CLOSED
+            self._results.clear()
+            self._probing = 0
+
+    def call(self, func, *args, **kwargs):
+        """通过熔断器调用func，func抛出异常记为失败"""
+        self.before_call()
+        try:
+            result = func(*args, **kwargs)
+        except Exception:
+            self.record_failure()
+            raise
+        self.record_success()
+        return result
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+# get_breaker新建熔断器时使用的默认参数，可以在启动时修改
+default_options = {}
+
+
+def get_breaker(name, **kwargs):
+    """
+    desc: 获取进程内共享的熔断器，同一个name在所有线程中是同一个实例
+    param: <name> 熔断器名称
+           <kwargs> 首次创建时的参数，见CircuitBreaker
+    """
+    breaker = _breakers.get(name)
+    if breaker is None:
+        with _breakers_lock:
+            breaker = _breakers.get(name)
+            if breaker is None:
+                options = dict(default_options, **kwargs)
+                breaker = CircuitBreaker(name, **options)
+                _breakers[name] = breaker
+    return breaker
+
+
+def breaker_states():
+    """所有熔断器的状态，方便暴露给监控接口"""
+    return [breaker.stats() for breaker in list(_breakers.values())]
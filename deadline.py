@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+# coding=utf-8
+"""
+@desc:   端到端的超时预算，一次操作设置一次，内部的每个网络请求都按剩余时间缩短超时
+         with deadline(3):
+             client.revoke_apply(instance_code, approval_code, companyid)
+
+"""
+
+import time
+import contextvars
+from contextlib import contextmanager
+
+_deadline = contextvars.ContextVar("deadline", default=None)
+
+
+class DeadlineExceeded(Exception):
+    """操作超出了调用方设置的时间预算"""
+    pass
+
+
+def remaining():
+    """
+    desc: 当前操作剩余的秒数
+    return: None 没有设置预算
+            float 剩余秒数，可能小于等于0
+    """
+    expire_at = _deadline.get()
+    if expire_at is None:
+        return None
+    return expire_at - time.monotonic()
+
+
+def budget_timeout(timeout):
+    """
+    desc: 按剩余预算缩短单次请求的超时时间
+    param: <timeout> 请求默认的超时秒数
+    return: 实际使用的超时秒数
+    raise: DeadlineExceeded 预算已经用完
+    """
+    left = remaining()
+    if left is None:
+        return timeout
+    if left <= 0:
+        raise DeadlineExceeded("deadline exceeded")
+    return min(timeout, left)
+
+
+def _caused_by_deadline(exc):
+    seen = set()
+    while exc is not None and id(exc) not in seen:
+        seen.add(id(exc))
+        if isinstance(exc, DeadlineExceeded):
+            return True
+        if exc.args and isinstance(exc.args[0], BaseException):
+            if _caused_by_deadline(exc.args[0]):
+                return True
+        exc = exc.__cause__ or exc.__context__
+    return False
+
+
+@contextmanager
+def deadline(seconds):
+    """
+    desc: 设置本次操作的时间预算，嵌套使用时取更早的截止时间
+          内部被包装成其他异常(比如FeishuException)的超时会在退出时统一抛出DeadlineExceeded
+    param: <seconds> 预算秒数
+    """
+    expire_at = time.monotonic() + seconds
+    outer = _deadline.get()
+    if outer is not None:
+        expire_at = min(expire_at, outer)
+    token = _deadline.set(expire_at)
+    try:
+        yield
+    except DeadlineExceeded:
+        raise
+    except Exception as e:
+        if _caused_by_deadline(e):
+            raise DeadlineExceeded("deadline of %ss exceeded" % seconds) from e
+        raise
+    finally:
+        _deadline.reset(token)
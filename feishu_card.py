@@ -0,0 +1,54 @@
+#!/usr/bin/env python
+# coding=utf-8
+"""
+@desc:   飞书卡片消息模板，卡片只在编译时序列化一次，
+         之后每个用户只需要把变量替换进预先序列化好的json骨架
+
+"""
+
+import re
+import json
+
+# 卡片中的占位符，例如 {"content": "你好 ${name}"}
+PLACEHOLDER = re.compile(r"\$\{(\w+)\}")
+
+
+class CardTemplate(object):
+    """
+    card: 卡片内容(dict)，字符串中的 ${var} 是每个用户的变量
+    用法:
+        tpl = CardTemplate({"elements": [{"tag": "div", "text": {"content": "你好 ${name}"}}]})
+        tpl.render(name="张三")  # 返回卡片json字符串
+    """
+
+    def __init__(self, card):
+        skeleton = json.dumps(card, ensure_ascii=False)
+        pieces = PLACEHOLDER.split(skeleton)
+        # split后偶数位是固定文本，奇数位是变量名
+        self.texts = pieces[0::2]
+        self.names = pieces[1::2]
+        self.variables = frozenset(self.names)
+        self.skeleton = skeleton
+
+    def render(self, values=None, **kwargs):
+        """
+        desc: 替换变量，返回序列化好的卡片json字符串
+        param: <values> 变量字典
+        return: str
+        """
+        if values is None:
+            values = kwargs
+        elif kwargs:
+            values = dict(values, **kwargs)
+        if not self.names:
+            return self.skeleton
+        texts = self.texts
+        out = [texts[0]]
+        for i, name in enumerate(self.names):
+            # 变量在json字符串内部，需要按json规则转义，去掉首尾的引号
+            out.append(json.dumps(str(values[name]), ensure_ascii=False)[1:-1])
+            out.append(texts[i + 1])
+        return "".join(out)
+
+    def render_dict(self, values=None, **kwargs):
+        return json.loads(self.render(values, **kwargs))
@@ -1,11 +1,20 @@
 import time
+import logging
+import threading
 from datetime import datetime
 import requests
 import json
-from flask import current_app
+import uuid
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
 
-from app import logger
-from app.exceptions.exceptions import FeishuException
+from circuit_breaker import get_breaker, CircuitOpenError
+from deadline import DeadlineExceeded, budget_timeout, remaining
+
+
+class FeishuException(Exception):
+    """脱离flask应用使用时的默认异常，在flask应用中使用时替换成应用的FeishuException"""
+    pass
 
 
 OPER_DICT = {
@@ -17,78 +26,236 @@ OPER_DICT = {
 }
 
 
+def _run_concurrently(func, items, max_workers=8):
+    """
+    并发执行func，按items的顺序返回[(item, result, exception)]
+    """
+    results = []
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        # 复制上下文，调用方设置的deadline在线程中同样生效
+        futures = [executor.submit(contextvars.copy_context().run, func, item) for item in items]
+        for item, future in zip(items, futures):
+            try:
+                results.append((item, future.result(), None))
+            except Exception as e:
+                results.append((item, None, e))
+    return results
+
+
 class FeiShu:
-    def __init__(self):
-        self.__app_id = current_app.config["FEISHU_APP_ID"]
-        self.__app_secret = current_app.config["FEISHU_APP_SECRET"]
-        self.__opes_url = current_app.config["FEISHU_OPEN_URL"]
-        self.__host_url = current_app.config["FEISHU_HOST_URL"]
-        self.headers = self.__init_header()
+    """
+    飞书客户端，线程安全，可以在进程内长期复用
+    config: 包含FEISHU_APP_ID/FEISHU_APP_SECRET/FEISHU_OPEN_URL/FEISHU_HOST_URL的字典，
+            不传时从flask的current_app.config读取
+    """
+    # token过期前提前刷新的秒数
+    token_refresh_ahead = 300
+    logger = logging.getLogger('feishu')
+    FeishuException = FeishuException
+
+    def __init__(self, config=None, logger=None, exception=None):
+        """
+        :param config: 飞书配置，不传时从flask的current_app.config读取，同时使用应用的logger和FeishuException
+        :param logger: 日志实例，默认logging.getLogger('feishu')
+        :param exception: 接口失败时抛出的异常类型，默认本模块的FeishuException
+        """
+        if config is None:
+            from flask import current_app
+            from app import logger as app_logger
+            from app.exceptions.exceptions import FeishuException as AppFeishuException
+            config = current_app.config
+            logger = logger or app_logger
+            exception = exception or AppFeishuException
+        if logger is not None:
+            self.logger = logger
+        if exception is not None:
+            self.FeishuException = exception
+        self.config = config
+        self.__app_id = config["FEISHU_APP_ID"]
+        self.__app_secret = config["FEISHU_APP_SECRET"]
+        self.__opes_url = config["FEISHU_OPEN_URL"]
+        self.__host_url = config["FEISHU_HOST_URL"]
+        self.__token_lock = threading.Lock()
+        self.__token_expire_at = 0
+        self.__headers = None
+        self.__local = threading.local()
+        self.__init_header()
+
+    @property
+    def session(self):
+        """每个线程一个session，复用连接"""
+        session = getattr(self.__local, 'session', None)
+        if session is None:
+            session = requests.Session()
+            self.__local.session = session
+        return session
+
+    @property
+    def headers(self):
+        if time.time() >= self.__token_expire_at:
+            self.__init_header()
+        return self.__headers
 
     def _get_tenant_access_token(self):
-        """认证接口"""
+        """认证接口，返回(token, 有效秒数)"""
         try:
-            response = requests.post(self.__opes_url + '/open-apis/auth/v3/app_access_token/internal/',
-                                     data={'app_id': self.__app_id, 'app_secret': self.__app_secret})
-            app_access_token = json.loads(response.text)['app_access_token']
-            return app_access_token
+            response = self.session.post(self.__opes_url + '/open-apis/auth/v3/app_access_token/internal/',
+                                         data={'app_id': self.__app_id, 'app_secret': self.__app_secret},
+                                         timeout=budget_timeout(5))
+            result = json.loads(response.text)
+            return result['app_access_token'], result.get('expire', 7200)
         except Exception as e:
-            logger.error("Feishu get tenant_access_token fail!")
-            raise FeishuException(e)
+            self.logger.error("Feishu get tenant_access_token fail!")
+            raise self.FeishuException(e)
 
     def __init_header(self):
-        """header构造方法"""
-        app_access_token = self._get_tenant_access_token()
-        headers = {
-            'content-type': 'application/json',
-            'Authorization': 'Bearer ' + app_access_token
-        }
-        return headers
+        """header构造方法，token快过期时由一个线程负责刷新"""
+        with self.__token_lock:
+            if self.__headers is not None and time.time() < self.__token_expire_at:
+                return self.__headers
+            app_access_token, expire = self._get_tenant_access_token()
+            self.__headers = {
+                'content-type': 'application/json',
+                'Authorization': 'Bearer ' + app_access_token
+            }
+            self.__token_expire_at = time.time() + expire - min(self.token_refresh_ahead, expire // 2)
+            return self.__headers
+
+    @staticmethod
+    def _finish_abandoned(breaker, failed):
+        """预算用完放弃请求时，有请求因为接口本身失败过记为失败，否则只释放熔断器的探测名额"""
+        if failed:
+            breaker.record_failure()
+        else:
+            breaker.release()
 
     def _post(self, url, data):
-        """封装底层post请求"""
-        data_to_send = json.dumps(data).encode("utf-8")
+        """
+        封装底层post请求，data可以是已经序列化好的json字符串
+        同一个接口连续失败时熔断，熔断期间直接抛出circuit_breaker.CircuitOpenError
+        在deadline.deadline()中调用时按剩余预算缩短超时、跳过来不及的重试，预算用完抛出deadline.DeadlineExceeded
+        """
+        if isinstance(data, str):
+            data_to_send = data.encode("utf-8")
+        else:
+            data_to_send = json.dumps(data).encode("utf-8")
+        budget_timeout(5)
+        breaker = get_breaker(url)
+        try:
+            breaker.before_call()
+        except CircuitOpenError:
+            self.logger.error("Feishu post circuit open! url=%s", url)
+            raise
         try:
             response = None
+            timeout = 5
+            # 请求id，请求和结果日志使用同一个id，log_analyzer按id配对
+            rid = uuid.uuid4().hex[:12]
+            # 是否有请求因为接口本身的原因失败(不是因为调用方预算不足)
+            failed = False
+            self.logger.info('Feishu post request. rid=%s url=%s', rid, url)
             for x in range(3):
                 try:
-                    response = requests.post(url, data=data_to_send, headers=self.headers, timeout=5)
+                    timeout = budget_timeout(5)
+                    response = self.session.post(url, data=data_to_send, headers=self.headers, timeout=timeout)
                 except Exception as e:
-                    time.sleep(1)
+                    if not isinstance(e, DeadlineExceeded) and \
+                            not (isinstance(e, requests.exceptions.Timeout) and timeout < 5):
+                        failed = True
                     if x == 2:
                         raise e
+                    left = remaining()
+                    if left is not None and left <= 1:
+                        # 剩余预算不够等待重试
+                        raise DeadlineExceeded("deadline exceeded after {} attempts, url={}".format(x + 1, url))
+                    time.sleep(1)
                 else:
                     break
-            logger.info('Feishu post response. url={},data={},response={}'.format(url, data, response.text))
-            return json.loads(response.text)
+            if response.status_code >= 500:
+                # 5xx和无法解析的响应说明接口本身不可用，由下面的except记为失败
+                response.raise_for_status()
+            result = json.loads(response.text)
+            self.logger.info('Feishu post response. rid=%s url=%s,data=%s,response=%s',
+                             rid, url, data, response.text)
+            breaker.record_success()
+            return result
+        except DeadlineExceeded:
+            self._finish_abandoned(breaker, failed)
+            self.logger.error("Feishu post deadline exceeded! rid=%s url=%s data=%s", rid, url, data)
+            raise
         except requests.exceptions.Timeout:
-            logger.error("Feishu post timeout! url={0} data={1}".format(url, data))
-            raise FeishuException('飞书接口post请求超时，请重试')
+            if timeout < 5:
+                # 最后一次超时是因为调用方预算不足，只有之前的请求自己失败过才算接口失败
+                self._finish_abandoned(breaker, failed)
+                self.logger.error("Feishu post deadline exceeded! rid=%s url=%s data=%s", rid, url, data)
+                raise DeadlineExceeded("deadline exceeded, url={}".format(url))
+            breaker.record_failure()
+            self.logger.error("Feishu post timeout! rid=%s url=%s data=%s", rid, url, data)
+            raise self.FeishuException('飞书接口post请求超时，请重试')
         except Exception as e:
-            logger.error("Feishu post msg fail! url={0} data={1} error by {2}".format(url, data, e))
-            raise FeishuException(e)
+            breaker.record_failure()
+            self.logger.error("Feishu post msg fail! rid=%s url=%s data=%s error by %s", rid, url, data, e)
+            raise self.FeishuException(e)
 
     def _get(self, url, data=None):
-        """封装底层get请求"""
+        """封装底层get请求，熔断和超时预算规则同_post"""
+        budget_timeout(5)
+        breaker = get_breaker(url)
+        try:
+            breaker.before_call()
+        except CircuitOpenError:
+            self.logger.error("Feishu get circuit open! url=%s", url)
+            raise
         try:
             response = None
+            timeout = 5
+            # 请求id，请求和结果日志使用同一个id，log_analyzer按id配对
+            rid = uuid.uuid4().hex[:12]
+            # 是否有请求因为接口本身的原因失败(不是因为调用方预算不足)
+            failed = False
+            self.logger.info('Feishu get request. rid=%s url=%s', rid, url)
             for x in range(3):
                 try:
-                    response = requests.get(url, params=data, headers=self.headers, timeout=5)
+                    timeout = budget_timeout(5)
+                    response = self.session.get(url, params=data, headers=self.headers, timeout=timeout)
                 except Exception as e:
-                    time.sleep(1)
+                    if not isinstance(e, DeadlineExceeded) and \
+                            not (isinstance(e, requests.exceptions.Timeout) and timeout < 5):
+                        failed = True
                     if x == 2:
                         raise e
+                    left = remaining()
+                    if left is not None and left <= 1:
+                        # 剩余预算不够等待重试
+                        raise DeadlineExceeded("deadline exceeded after {} attempts, url={}".format(x + 1, url))
+                    time.sleep(1)
                 else:
                     break
-            logger.info('Feishu get response. url={},data={},response={}'.format(url, data, response.text))
-            return json.loads(response.text)
+            if response.status_code >= 500:
+                # 5xx和无法解析的响应说明接口本身不可用，由下面的except记为失败
+                response.raise_for_status()
+            result = json.loads(response.text)
+            self.logger.info('Feishu get response. rid=%s url=%s,data=%s,response=%s',
+                             rid, url, data, response.text)
+            breaker.record_success()
+            return result
+        except DeadlineExceeded:
+            self._finish_abandoned(breaker, failed)
+            self.logger.error("Feishu get deadline exceeded! rid=%s url=%s data=%s", rid, url, data)
+            raise
         except requests.exceptions.Timeout:
-            logger.error("Feishu get timeout! url={0} data={1}".format(url, data))
-            raise FeishuException('飞书接口get请求超时，请重试')
+            if timeout < 5:
+                # 最后一次超时是因为调用方预算不足，只有之前的请求自己失败过才算接口失败
+                self._finish_abandoned(breaker, failed)
+                self.logger.error("Feishu get deadline exceeded! rid=%s url=%s data=%s", rid, url, data)
+                raise DeadlineExceeded("deadline exceeded, url={}".format(url))
+            breaker.record_failure()
+            self.logger.error("Feishu get timeout! rid=%s url=%s data=%s", rid, url, data)
+            raise self.FeishuException('飞书接口get请求超时，请重试')
         except Exception as e:
-            logger.error("Feishu get msg fail! url={0} data={1} error by {2}".format(url, data, e))
-            raise FeishuException(e)
+            breaker.record_failure()
+            self.logger.error("Feishu get msg fail! rid=%s url=%s data=%s error by %s", rid, url, data, e)
+            raise self.FeishuException(e)
 
     def _send_msg(self, data):
         """消息发送内部使用"""
@@ -121,10 +288,12 @@ class FeiShu:
                     'card': content
                 })
             if result['code'] != 0:
-                logger.error("Send user msg fail! result={0}".format(result))
-                raise FeishuException(result)
+                self.logger.error("Send user msg fail! result={0}".format(result))
+                raise self.FeishuException(result)
+        except CircuitOpenError:
+            raise
         except Exception as e:
-            raise FeishuException(e)
+            raise self.FeishuException(e)
 
     def send_user_msg_many(self, open_ids, content, type='text'):
         """
@@ -153,11 +322,53 @@ class FeiShu:
                         'card': content
                     })
                 if result['code'] != 0:
-                    logger.error("Send user msg many fail! result={0}".format(result))
-                    raise FeishuException(
+                    self.logger.error("Send user msg many fail! result={0}".format(result))
+                    raise self.FeishuException(
                         '发送成功{}条，发送失败{}条，错误信息：{}'.format(i + 199, len(open_ids) - i - 199, str(result)))
+        except CircuitOpenError:
+            raise
         except Exception as e:
-            raise FeishuException(e)
+            raise self.FeishuException(e)
+
+    def send_card_template(self, template, recipients, max_workers=8):
+        """
+        按模板给大量用户发送个性化卡片消息
+        渲染结果相同的用户合并成batch_send发送，其余的用户并发单独发送
+        :param template: feishu_card.CardTemplate，卡片只编译一次
+        :param recipients: {open_id: 变量字典}
+        :param max_workers: 并发发送的线程数
+        :return: {'success': [open_id,,,], 'fail': {open_id: 错误信息}}
+        """
+        groups = {}
+        for open_id, values in recipients.items():
+            groups.setdefault(template.render(values), []).append(open_id)
+
+        jobs = []
+        for card, open_ids in groups.items():
+            if len(open_ids) == 1:
+                jobs.append((open_ids, '{"open_id": %s, "msg_type": "interactive", "card": %s}'
+                             % (json.dumps(open_ids[0]), card), '/open-apis/message/v4/send/'))
+                continue
+            for i in range(0, len(open_ids), 199):
+                chunk = open_ids[i:i + 199]
+                jobs.append((chunk, '{"open_ids": %s, "msg_type": "interactive", "card": %s}'
+                             % (json.dumps(chunk), card), '/open-apis/message/v4/batch_send/'))
+
+        def send(job):
+            result = self._post(self.__opes_url + job[2], data=job[1])
+            if result['code'] != 0:
+                raise self.FeishuException(result)
+            return result
+
+        sent = {'success': [], 'fail': {}}
+        for job, _, error in _run_concurrently(send, jobs, max_workers):
+            if error is None:
+                sent['success'].extend(job[0])
+            else:
+                self.logger.error("Send card template fail! open_ids={0} error by {1}".format(job[0], error))
+                for open_id in job[0]:
+                    sent['fail'][open_id] = str(error)
+        return sent
 
     def get_user_id_info(self, user_code, email_type='@company.com'):
         """
@@ -176,10 +387,46 @@ class FeiShu:
                 user_info = result['data']['email_users'][email_code][0]
                 return user_info
             else:
-                raise FeishuException('飞书账号未与邮箱绑定，请联系飞书管理员绑定邮箱')
+                raise self.FeishuException('飞书账号未与邮箱绑定，请联系飞书管理员绑定邮箱')
+        except CircuitOpenError:
+            raise
         except Exception as ex:
-            logger.error("Feishu get user id info fail! user_code={0} error by {1}".format(user_code, ex))
-            raise FeishuException(ex)
+            self.logger.error("Feishu get user id info fail! user_code={0} error by {1}".format(user_code, ex))
+            raise self.FeishuException(ex)
+
+    def get_user_id_info_many(self, user_codes, email_type='@company.com', errors=None):
+        """
+        批量通过邮箱获取用户的飞书唯一标识，每次最多查询50个邮箱
+        :param user_codes: company id 列表
+        :param email_type: 邮箱类型
+        :param errors: 传入dict时某一批查询失败不抛出异常，这一批的user_code和错误信息写入errors
+        :return: {user_code: {"open_id": "...", "user_id": "..."}}，未绑定邮箱或查询失败的用户不在结果中
+        """
+        user_codes = [code for code in user_codes if code]
+        users = {}
+        for i in range(0, len(user_codes), 50):
+            chunk = user_codes[i:i + 50]
+            try:
+                result = self._get(self.__opes_url + '/open-apis/user/v1/batch_get_id',
+                                   {'emails': [code + email_type for code in chunk]})
+                if result['code'] != 0:
+                    raise self.FeishuException(result.get('msg'))
+                email_users = result['data'].get('email_users', {})
+            except CircuitOpenError as ex:
+                if errors is None:
+                    raise
+                errors.update((code, str(ex)) for code in chunk)
+                continue
+            except Exception as ex:
+                self.logger.error("Feishu get user id info many fail! user_codes={0} error by {1}".format(chunk, ex))
+                if errors is None:
+                    raise self.FeishuException(ex)
+                errors.update((code, str(ex)) for code in chunk)
+                continue
+            for code in chunk:
+                if code + email_type in email_users:
+                    users[code] = email_users[code + email_type][0]
+        return users
 
     def get_user_info(self, user_open_id):
         """
@@ -203,20 +450,24 @@ class FeiShu:
             if user_info['code'] == 0:
                 return user_info['data']['user_infos'][0]
             else:
-                raise FeishuException('获取该用户飞书个人信息失败,请联系管理员处理')
+                raise self.FeishuException('获取该用户飞书个人信息失败,请联系管理员处理')
+        except CircuitOpenError:
+            raise
         except Exception as ex:
-            logger.error("Feishu get user info fail! user_open_id={0} error by {1}".format(user_open_id, ex))
-            raise FeishuException(ex)
+            self.logger.error("Feishu get user info fail! user_open_id={0} error by {1}".format(user_open_id, ex))
+            raise self.FeishuException(ex)
 
     def get_department_info(self, open_department_id):
         try:
             department = self._get(self.__opes_url + '/open-apis/contact/v1/department/info/get',
                                    {'open_department_id': open_department_id})
             return department
+        except CircuitOpenError:
+            raise
         except Exception as ex:
-            logger.error(
+            self.logger.error(
                 "Feishu get department info fail! open_department_id={0} error by {1}".format(open_department_id, ex))
-            raise FeishuException(ex)
+            raise self.FeishuException(ex)
 
     def approval_create(self, approval_code, apply_user_id, data, approval_user_id=None, approval_node_id=None):
         """
@@ -243,14 +494,16 @@ class FeiShu:
             print(approval_data)
             result = self._post(self.__host_url + '/approval/openapi/v2/instance/create', approval_data)
             if result['code'] != 0:
-                raise FeishuException('飞书创建审批失败,错误信息：{}，请联系管理员处理'.format(result['msg']))
+                raise self.FeishuException('飞书创建审批失败,错误信息：{}，请联系管理员处理'.format(result['msg']))
             else:
                 return result['data']
+        except CircuitOpenError:
+            raise
         except Exception as ex:
-            logger.error(
+            self.logger.error(
                 "Feishu approval create fail! approval_code={0},apply_user_id={1},data={2},approval_user_id={3} error by {4}"
                     .format(approval_code, apply_user_id, data, approval_user_id, ex))
-            raise FeishuException(ex)
+            raise self.FeishuException(ex)
 
     def approval_revoke(self, approval_code, instance_code, apply_user_id):
         """
@@ -270,13 +523,15 @@ class FeiShu:
                 if self.__check_approval_status(result, instance_code, 'CANCELED'):
                     return 'repeat'
                 else:
-                    raise FeishuException('飞书撤回审批失败,错误信息：{}，请联系管理员处理'.format(result['msg']))
+                    raise self.FeishuException('飞书撤回审批失败,错误信息：{}，请联系管理员处理'.format(result['msg']))
             else:
                 return 'success'
+        except CircuitOpenError:
+            raise
         except Exception as ex:
-            logger.error("Feishu approval revoke fail! instance_code={0},error by {1}"
+            self.logger.error("Feishu approval revoke fail! instance_code={0},error by {1}"
                          .format(instance_code, ex))
-            raise FeishuException(ex)
+            raise self.FeishuException(ex)
 
     def get_approval_info(self, instance_code):
         """
@@ -291,11 +546,13 @@ class FeiShu:
             if result['code'] == 0:
                 return result['data']
             else:
-                raise FeishuException('飞书获取审批实例详情失败，错误信息是:{0},请联系管理员处理'.format(result['msg']))
+                raise self.FeishuException('飞书获取审批实例详情失败，错误信息是:{0},请联系管理员处理'.format(result['msg']))
+        except CircuitOpenError:
+            raise
         except Exception as ex:
-            logger.error("Feishu approval revoke fail! instance_code={0},error by {1}"
+            self.logger.error("Feishu approval revoke fail! instance_code={0},error by {1}"
                          .format(instance_code, ex))
-            raise FeishuException(ex)
+            raise self.FeishuException(ex)
 
     def __check_approval_status(self, result, instance_code, oper):
         """
@@ -311,19 +568,21 @@ class FeiShu:
                 if approval_info['status'] == oper:
                     return True
                 elif approval_info['status'] == 'APPROVED':
-                    raise FeishuException('飞书审批已经通过,无法进行审批{}'.format(OPER_DICT[oper]))
+                    raise self.FeishuException('飞书审批已经通过,无法进行审批{}'.format(OPER_DICT[oper]))
                 elif approval_info['status'] == 'REJECTED':
-                    raise FeishuException('飞书审批已经拒绝,无法进行审批{}'.format(OPER_DICT[oper]))
+                    raise self.FeishuException('飞书审批已经拒绝,无法进行审批{}'.format(OPER_DICT[oper]))
                 elif approval_info['status'] == 'CANCELED':
-                    raise FeishuException('飞书审批已经撤回,无法进行审批{}'.format(OPER_DICT[oper]))
+                    raise self.FeishuException('飞书审批已经撤回,无法进行审批{}'.format(OPER_DICT[oper]))
                 elif approval_info['status'] == 'DELETED':
-                    raise FeishuException('飞书审批已经删除,无法进行审批{}'.format(OPER_DICT[oper]))
+                    raise self.FeishuException('飞书审批已经删除,无法进行审批{}'.format(OPER_DICT[oper]))
                 else:
                     return False
+            except CircuitOpenError:
+                raise
             except Exception as ex:
-                logger.error("Feishu check status approval fail! result={0},instance_code={1},oper{2},error by {3}"
+                self.logger.error("Feishu check status approval fail! result={0},instance_code={1},oper{2},error by {3}"
                              .format(result, instance_code, oper, ex))
-                raise FeishuException(ex)
+                raise self.FeishuException(ex)
 
 
 class FeishuApproval(FeiShu):
@@ -399,66 +658,71 @@ class FeishuCapacityAndEmergencyApproval(FeishuApproval):
     飞书扩容审批流操作类
     """
 
+    def _approval_config(self, key):
+        """审批流配置按key读取一次后缓存，缺少配置时抛出KeyError"""
+        conf = self.__dict__.setdefault('_approval_conf', {})
+        if key not in conf:
+            conf[key] = self.config[key]
+        return conf[key]
+
     def create_apply(self, capacity_obj=None, emergency_obj=None, unit_capacity_objs=None,
                      leader=None, user_code=None, app_approval=None, app_approval_detail=None):
         """
         创建审批申请
         """
-        FS_PLUS_CAPACITY_APPROVAL_CODE = current_app.config["FS_PLUS_CAPACITY_APPROVAL_CODE"]
-        FS_REDUCE_CAPACITY_APPROVAL_CODE = current_app.config["FS_REDUCE_CAPACITY_APPROVAL_CODE"]
-        FS_EMERGENCY_RELEASE_APPROVAL_CODE = current_app.config["FS_EMERGENCY_RELEASE_APPROVAL_CODE"]
-        
         user_id_info = self.get_user_id_info(user_code)
-        value = ""
+        return self._submit_apply(user_id_info['user_id'], capacity_obj, emergency_obj, unit_capacity_objs,
+                                  leader, app_approval, app_approval_detail)
 
+    def create_apply_many(self, applies, max_workers=8):
+        """
+        批量创建审批申请，申请人一次性批量查询，审批并发提交
+        :param applies: 审批参数列表，每一项是create_apply的参数字典
+        :param max_workers: 并发提交的线程数
+        :return: 与applies顺序一致的结果列表 [{'result': 飞书返回数据, 'error': None}, {'result': None, 'error': 错误信息}]
+        """
+        # 某一批申请人查询失败只影响这一批的申请
+        lookup_errors = {}
+        users = self.get_user_id_info_many({apply.get('user_code') for apply in applies}, errors=lookup_errors)
+
+        def submit(apply):
+            if apply.get('user_code') in lookup_errors:
+                raise self.FeishuException(lookup_errors[apply.get('user_code')])
+            user_id_info = users.get(apply.get('user_code'))
+            if user_id_info is None:
+                raise self.FeishuException('飞书账号未与邮箱绑定，请联系飞书管理员绑定邮箱')
+            return self._submit_apply(user_id_info['user_id'], apply.get('capacity_obj'), apply.get('emergency_obj'),
+                                      apply.get('unit_capacity_objs'), apply.get('leader'), apply.get('app_approval'),
+                                      apply.get('app_approval_detail'))
+
+        results = []
+        for apply, result, error in _run_concurrently(submit, applies, max_workers):
+            if error is None:
+                results.append({'result': result, 'error': None})
+            else:
+                self.logger.error("Feishu create apply many fail! user_code={0} error by {1}"
+                             .format(apply.get('user_code'), error))
+                results.append({'result': None, 'error': str(error)})
+        return results
+
+    def _submit_apply(self, apply_user_id, capacity_obj=None, emergency_obj=None, unit_capacity_objs=None,
+                      leader=None, app_approval=None, app_approval_detail=None):
+        """构建表单并提交审批"""
         if capacity_obj:
             # 扩容分支
             if capacity_obj.capacity_kind == 0:
-                approval_code = FS_PLUS_CAPACITY_APPROVAL_CODE.get("approval_code")
-                approval_node_id = FS_PLUS_CAPACITY_APPROVAL_CODE.get("approval_node_id")
-                for unit_capacity in unit_capacity_objs:
-                    unit_capacity_blue_now = unit_capacity.now_blue_instance - unit_capacity.blue_instance if unit_capacity.now_blue_instance is not None and unit_capacity.blue_instance is not None else 0
-                    unit_capacity_green_now = unit_capacity.now_green_instance - unit_capacity.green_instance if unit_capacity.now_green_instance is not None and unit_capacity.green_instance is not None else 0
-                    unit_capacity_gray_now = unit_capacity.now_gray_instance - unit_capacity.gray_instance if unit_capacity.now_gray_instance is not None and unit_capacity.gray_instance is not None else 0
-                    value += "单元{}({}): \n蓝组现有实例数: {}，扩容数: {};" \
-                             "\n绿组现有实例数: {}，扩容数: {};" \
-                             "\n灰组现有实例数: {}，扩容数: {}\n\n".format(unit_capacity.unit, "扩容",
-                                                                unit_capacity.blue_instance if unit_capacity.blue_instance else 0,
-                                                                unit_capacity_blue_now,
-                                                                unit_capacity.green_instance if unit_capacity.green_instance else 0,
-                                                                unit_capacity_green_now,
-                                                                unit_capacity.gray_instance if unit_capacity.gray_instance else 0,
-                                                                unit_capacity_gray_now)
-                if capacity_obj.app_type == 0:
-                    deploy_type = FS_PLUS_CAPACITY_APPROVAL_CODE.get("form_info").get("deploy_type").get('k8s')
-                else:
-                    deploy_type = FS_PLUS_CAPACITY_APPROVAL_CODE.get("form_info").get("deploy_type").get('dvd')
+                approval_config = self._approval_config("FS_PLUS_CAPACITY_APPROVAL_CODE")
+                value = self.handle_capacity_text(unit_capacity_objs, "扩容", plus=True)
             # 缩容分支
             else:
-                approval_code = FS_REDUCE_CAPACITY_APPROVAL_CODE.get("approval_code")
-                approval_node_id = FS_REDUCE_CAPACITY_APPROVAL_CODE.get("approval_node_id")
-                for unit_capacity in unit_capacity_objs:
-                    unit_capacity_blue_now = unit_capacity.blue_instance - unit_capacity.now_blue_instance if unit_capacity.now_blue_instance is not None and unit_capacity.blue_instance is not None else 0
-                    unit_capacity_green_now = unit_capacity.green_instance - unit_capacity.now_green_instance if unit_capacity.now_green_instance is not None and unit_capacity.green_instance is not None else 0
-                    unit_capacity_gray_now = unit_capacity.gray_instance - unit_capacity.now_gray_instance if unit_capacity.now_gray_instance is not None and unit_capacity.gray_instance is not None else 0
-                    value += "单元{}({}): \n蓝组现有实例数: {}，缩容数: {};" \
-                             "\n绿组现有实例数: {}，缩容数: {};" \
-                             "\n灰组现有实例数: {}，缩容数: {}\n\n".format(unit_capacity.unit, "缩容",
-                                                                unit_capacity.blue_instance if unit_capacity.blue_instance else 0,
-                                                                # unit_capacity.blue_instance - unit_capacity.now_blue_instance,
-                                                                unit_capacity_blue_now,
-                                                                unit_capacity.green_instance if unit_capacity.green_instance else 0,
-                                                                # unit_capacity.green_instance - unit_capacity.now_green_instance,
-                                                                unit_capacity_green_now,
-                                                                unit_capacity.gray_instance if unit_capacity.gray_instance else 0,
-                                                                # unit_capacity.gray_instance - unit_capacity.now_gray_instance
-                                                                unit_capacity_gray_now
-                                                                )
-
-                if capacity_obj.app_type == 0:
-                    deploy_type = FS_REDUCE_CAPACITY_APPROVAL_CODE.get("form_info").get("deploy_type").get('k8s')
-                else:
-                    deploy_type = FS_REDUCE_CAPACITY_APPROVAL_CODE.get("form_info").get("deploy_type").get('dvd')
+                approval_config = self._approval_config("FS_REDUCE_CAPACITY_APPROVAL_CODE")
+                value = self.handle_capacity_text(unit_capacity_objs, "缩容", plus=False)
+            approval_code = approval_config.get("approval_code")
+            approval_node_id = approval_config.get("approval_node_id")
+            if capacity_obj.app_type == 0:
+                deploy_type = approval_config.get("form_info").get("deploy_type").get('k8s')
+            else:
+                deploy_type = approval_config.get("form_info").get("deploy_type").get('dvd')
 
             # 构建表单
             form_data = [{"id": "module_code", "type": "input", "value": capacity_obj.app_name},
@@ -466,6 +730,7 @@ class FeishuCapacityAndEmergencyApproval(FeishuApproval):
                          {"id": "deploy_type", "type": "radioV2", "value": deploy_type},
                          {"id": "apply_reason", "type": "textarea", "value": capacity_obj.apply_reason}]
         elif emergency_obj:
+            FS_EMERGENCY_RELEASE_APPROVAL_CODE = self._approval_config("FS_EMERGENCY_RELEASE_APPROVAL_CODE")
             approval_code = FS_EMERGENCY_RELEASE_APPROVAL_CODE.get("approval_code")
             approval_node_id = FS_EMERGENCY_RELEASE_APPROVAL_CODE.get("approval_node_id")
             leader_approval = FS_EMERGENCY_RELEASE_APPROVAL_CODE.get("form_info").get("approval_type").get(
@@ -492,23 +757,49 @@ class FeishuCapacityAndEmergencyApproval(FeishuApproval):
                          {"id": "apply_reason", "type": "textarea", "value": emergency_obj.apply_reason}]
         elif app_approval:
             approval_node_id = None
-            approval_code = current_app.config["FS_APP_DETAIL_APPROVAL_CODE"].get("approval_code")
+            approval_code = self._approval_config("FS_APP_DETAIL_APPROVAL_CODE").get("approval_code")
             form_data = self.handle_app_approval(app_approval_detail)
         else:
             raise TypeError("必须满足扩缩容/紧急发布任意一种模式")
 
         if leader:
             feishu_result = self.approval_create(approval_code,
-                                                 user_id_info['user_id'],
+                                                 apply_user_id,
                                                  form_data,
                                                  approval_user_id=leader,
                                                  approval_node_id=approval_node_id)
         else:
             feishu_result = self.approval_create(approval_code,
-                                                 user_id_info['user_id'],
+                                                 apply_user_id,
                                                  form_data)
         return feishu_result
 
+    @staticmethod
+    def handle_capacity_text(unit_capacity_objs, kind, plus=True):
+        """
+        构建扩缩容的实例数说明
+        :param unit_capacity_objs: 单元扩缩容对象列表
+        :param kind: 扩容/缩容
+        :param plus: True 扩容数=调整后实例数-现有实例数，False 缩容数=现有实例数-调整后实例数
+        :return:
+        """
+        lines = []
+        for unit_capacity in unit_capacity_objs:
+            counts = []
+            for color in ('blue', 'green', 'gray'):
+                instance = getattr(unit_capacity, color + '_instance')
+                now_instance = getattr(unit_capacity, 'now_' + color + '_instance')
+                if now_instance is not None and instance is not None:
+                    diff = now_instance - instance if plus else instance - now_instance
+                else:
+                    diff = 0
+                counts.append(instance if instance else 0)
+                counts.append(diff)
+            lines.append("单元{0}({1}): \n蓝组现有实例数: {2}，{1}数: {3};"
+                         "\n绿组现有实例数: {4}，{1}数: {5};"
+                         "\n灰组现有实例数: {6}，{1}数: {7}\n\n".format(unit_capacity.unit, kind, *counts))
+        return "".join(lines)
+
     def handle_app_approval(self, data):
         # 构建表单
         value = ""
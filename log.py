@@ -1,13 +1,122 @@
 #!/usr/bin/python
 #coding=utf-8
 
+import re
 import time
 import logging
+import threading
 import logging.handlers
+from collections import OrderedDict
+
+# 消息模板中的可变部分: uuid、0x开头的地址、带数字的8位以上16进制id(请求id、ObjectId等)、数字
+VARIABLE = re.compile(r"[0-9a-fA-F]{8}(?:-[0-9a-fA-F]{4}){3}-[0-9a-fA-F]{12}"
+                      r"|0[xX][0-9a-fA-F]+"
+                      r"|\b(?=[0-9a-fA-F]*\d)[0-9a-fA-F]{8,}\b"
+                      r"|\d+")
 
 log_format = "%(name)s %(levelname)s %(asctime)s (%(filename)s: %(lineno)d) - %(message)s"
 
 
+class StormFilter(logging.Filter):
+    """
+    日志风暴抑制，按(logger, level, 消息模板)限流
+    window: 统计窗口，单位秒
+    budgets: 每个窗口内每种消息最多输出的条数，按level配置，例如{logging.ERROR: 20}
+    sample: 超出budget后每sample条输出1条，0表示全部丢弃
+    template_len: 消息没有参数(已经格式化好)时，取前template_len个字符、数字/16进制id/uuid替换成#作为模板，
+                  其他可变内容(比如用户名)会被当成不同的消息，需要抑制的日志最好用%s参数的写法
+    max_keys: 最多统计的消息种类数，超过时淘汰最久没出现的消息
+    窗口结束后(下次出现同一种消息或者每个窗口一次的检查时)输出一条"suppressed N similar messages"汇总
+    """
+
+    def __init__(self, window=60, budgets=None, default_budget=100, sample=0, template_len=64,
+                 max_keys=10000):
+        logging.Filter.__init__(self)
+        self.window = window
+        self.budgets = budgets or {}
+        self.default_budget = default_budget
+        self.sample = sample
+        self.template_len = template_len
+        self.max_keys = max_keys
+        # {key: [窗口开始时间, 窗口内出现次数, 被抑制次数]}，按最近出现的顺序排列，超过max_keys时淘汰最久没出现的
+        self.counters = OrderedDict()
+        self.next_sweep = 0
+        self.lock = threading.Lock()
+
+    def _sweep(self, now):
+        """清理窗口已经结束的消息，返回其中需要输出的汇总"""
+        pending = []
+        for key in [k for k, c in self.counters.items() if now - c[0] >= self.window]:
+            counter = self.counters.pop(key)
+            if counter[2]:
+                pending.append((key, counter[2], now - counter[0]))
+        return pending
+
+    def _key(self, record):
+        if record.args:
+            return record.name, record.levelno, record.msg
+        # 多取一些再截断，避免截断在id中间留下半个id
+        template = VARIABLE.sub("#", str(record.msg)[:self.template_len * 2])
+        return record.name, record.levelno, template[:self.template_len]
+
+    def filter(self, record):
+        if getattr(record, "storm_summary", False):
+            return True
+        key = self._key(record)
+        now = record.created
+        summaries = []
+        with self.lock:
+            counter = self.counters.get(key)
+            if counter is None or now - counter[0] >= self.window:
+                if counter is not None and counter[2]:
+                    summaries.append((key, counter[2], now - counter[0]))
+                elif counter is None:
+                    while len(self.counters) >= self.max_keys:
+                        old_key, old = self.counters.popitem(last=False)
+                        if old[2]:
+                            summaries.append((old_key, old[2], now - old[0]))
+                self.counters[key] = [now, 1, 0]
+                passed = True
+            else:
+                counter[1] += 1
+                passed = counter[1] <= self.budgets.get(record.levelno, self.default_budget)
+                if not passed and self.sample and counter[1] % self.sample == 0:
+                    passed = True
+                if not passed:
+                    counter[2] += 1
+            self.counters.move_to_end(key)
+            if now >= self.next_sweep:
+                # 每个窗口检查一次，已经结束的风暴即使不再出现也能输出汇总
+                self.next_sweep = now + self.window
+                summaries.extend(self._sweep(now))
+        for summary in summaries:
+            self._emit_summary(*summary)
+        return passed
+
+    def _collect(self, now):
+        pending = []
+        for key, counter in self.counters.items():
+            if counter[2]:
+                pending.append((key, counter[2], now - counter[0]))
+                counter[2] = 0
+        return pending
+
+    def _emit_summary(self, key, suppressed, seconds):
+        name, levelno, template = key
+        summary = logging.LogRecord(name, levelno, __file__, 0,
+                                    "suppressed %d similar messages in %.1fs: %s",
+                                    (suppressed, seconds, template), None)
+        summary.storm_summary = True
+        logging.getLogger(name).handle(summary)
+
+    def flush(self):
+        """输出所有还没汇总的抑制条数，一般在退出前调用"""
+        with self.lock:
+            pending = self._collect(time.time())
+        for summary in pending:
+            self._emit_summary(*summary)
+
+
 class Logger:
     logger_map = {}
 
@@ -44,6 +153,15 @@ class Logger:
     def remove(self):
         Logger.logger_map.pop(self.name)
 
+    def addStormFilter(self, window=60, budgets=None, default_budget=100, sample=0):
+        """
+        开启日志风暴抑制，参数见StormFilter
+        return: StormFilter实例，退出前可以调用flush()输出剩余的汇总
+        """
+        storm_filter = StormFilter(window=window, budgets=budgets, default_budget=default_budget, sample=sample)
+        self.logger.addFilter(storm_filter)
+        return storm_filter
+
     def modify_rotating(self, maxBytes=None, backupCount=None):
         ro_handler = self.logger.handlers[0]
         if maxBytes:
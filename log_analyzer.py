@@ -0,0 +1,266 @@
+#!/usr/bin/env python
+# coding=utf-8
+"""
+@desc:   分析log.Logger写出的滚动日志(xxx.log, xxx.log.1 ... xxx.log.128，支持.gz/.bz2压缩)
+         统计飞书客户端每个接口的调用次数、错误率、请求到响应的耗时
+         python log_analyzer.py /tmp/feishu.log --start "2018-09-10 10:00:00" --end "2018-09-10 11:00:00"
+
+"""
+
+import os
+import re
+import bz2
+import mmap
+import gzip
+import argparse
+import datetime
+from collections import deque
+from multiprocessing import Pool
+
+# 与log.log_format对应: %(name)s %(levelname)s %(asctime)s (%(filename)s: %(lineno)d) - %(message)s
+LINE_RE = re.compile(rb"^(\S+) ([A-Z]+) (\d{4}-\d\d-\d\d \d\d:\d\d:\d\d,\d{3}) \(([^:]*): \d+\) - (.*)$")
+# 飞书客户端的请求/响应/错误日志
+# rid是每次请求的id，旧日志没有rid
+FEISHU_RE = re.compile(rb"Feishu (post|get) (request|response|timeout|msg fail|circuit open|deadline exceeded)"
+                       rb"[.!] (?:rid=(\w+) )?url=(.+?)(?:,data=| data=|$)")
+TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+ERROR_EVENTS = (b"timeout", b"msg fail", b"circuit open", b"deadline exceeded")
+
+
+def parse_time(asctime):
+    """2018-09-10 10:00:00,123 -> datetime，比strptime快"""
+    return datetime.datetime(int(asctime[0:4]), int(asctime[5:7]), int(asctime[8:10]),
+                             int(asctime[11:13]), int(asctime[14:16]), int(asctime[17:19]),
+                             int(asctime[20:23]) * 1000)
+
+
+def rotated_files(filename):
+    """
+    desc: 按时间从旧到新列出滚动日志文件
+    param: <filename> 当前写入的日志文件名
+    return: [path,,,]
+    """
+    dirname = os.path.dirname(filename) or "."
+    basename = os.path.basename(filename)
+    pattern = re.compile(r"^%s(?:\.(\d+))?(\.gz|\.bz2)?$" % re.escape(basename))
+    files = []
+    for name in os.listdir(dirname):
+        match = pattern.match(name)
+        if match:
+            files.append((int(match.group(1) or 0), os.path.join(dirname, name)))
+    return [path for _, path in sorted(files, reverse=True)]
+
+
+def _line_time(buf, pos, end):
+    """从pos开始找到第一行带时间的日志，返回(时间, 行首位置)"""
+    while pos < end:
+        eol = buf.find(b"\n", pos, end)
+        if eol == -1:
+            eol = end
+        match = LINE_RE.match(buf[pos:eol].rstrip(b"\r"))
+        if match:
+            return parse_time(match.group(3)), pos
+        pos = eol + 1
+    return None, end
+
+
+def _seek_time(buf, start_time):
+    """二分查找第一条时间不早于start_time的日志的位置"""
+    lo, hi = 0, len(buf)
+    while lo < hi:
+        mid = (lo + hi) // 2
+        line_start = buf.rfind(b"\n", 0, mid) + 1
+        line_time, pos = _line_time(buf, line_start, hi)
+        if line_time is None or line_time >= start_time:
+            hi = line_start
+        else:
+            lo = buf.find(b"\n", pos, hi) + 1 or hi
+    return lo
+
+
+def _iter_plain(path, start_time, end_time):
+    with open(path, "rb") as fp:
+        if os.fstat(fp.fileno()).st_size == 0:
+            return
+        buf = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            size = len(buf)
+            if end_time is not None:
+                first_time, _ = _line_time(buf, 0, size)
+                if first_time is not None and first_time > end_time:
+                    return
+            if start_time is not None:
+                # 最后一行都早于start_time时整个文件跳过
+                last_start = buf.rfind(b"\n", 0, size - 1) + 1
+                last_time, _ = _line_time(buf, last_start, size)
+                if last_time is not None and last_time < start_time:
+                    return
+            pos = _seek_time(buf, start_time) if start_time is not None else 0
+            while pos < size:
+                eol = buf.find(b"\n", pos)
+                if eol == -1:
+                    eol = size
+                yield buf[pos:eol]
+                pos = eol + 1
+        finally:
+            buf.close()
+
+
+def _iter_compressed(path):
+    opener = gzip.open if path.endswith(".gz") else bz2.open
+    with opener(path, "rb") as fp:
+        for line in fp:
+            yield line.rstrip(b"\n")
+
+
+def _count_by_rid(stat, event, rid, line_time, started, finished):
+    """按请求id统计，每个请求只算一次调用，响应之后又出现的错误(比如解析响应失败)只把这次调用改记为错误"""
+    if event == b"request":
+        started[rid] = line_time
+        return
+    is_error = event in ERROR_EVENTS
+    if rid in finished:
+        if is_error and not finished[rid]:
+            stat["errors"] += 1
+            finished[rid] = True
+        return
+    finished[rid] = is_error
+    stat["calls"] += 1
+    if is_error:
+        stat["errors"] += 1
+    if rid in started:
+        stat["latencies"].append((line_time - started.pop(rid)).total_seconds())
+
+
+def analyze_file(args):
+    """
+    desc: 分析单个日志文件，返回可以合并的统计结果
+    param: <args> (path, start_time, end_time)
+    return: {"lines": n, "first": 时间, "last": 时间, "endpoints": {(method, url): {...}}}
+    """
+    path, start_time, end_time = args
+    if path.endswith((".gz", ".bz2")):
+        lines = _iter_compressed(path)
+    else:
+        lines = _iter_plain(path, start_time, end_time)
+
+    endpoints = {}
+    pending = {}
+    # {rid: 请求时间}，{rid: 是否已经记为错误}
+    started = {}
+    finished = {}
+    result = {"path": path, "lines": 0, "first": None, "last": None, "endpoints": endpoints}
+    for line in lines:
+        match = LINE_RE.match(line.rstrip(b"\r"))
+        if not match:
+            continue
+        line_time = parse_time(match.group(3))
+        if start_time is not None and line_time < start_time:
+            continue
+        if end_time is not None and line_time > end_time:
+            break
+        result["lines"] += 1
+        if result["first"] is None:
+            result["first"] = line_time
+        result["last"] = line_time
+
+        feishu = FEISHU_RE.search(match.group(5))
+        if not feishu:
+            continue
+        method, event, rid, url = feishu.groups()
+        key = (method.decode(), url.decode("utf-8", "replace"))
+        stat = endpoints.get(key)
+        if stat is None:
+            stat = endpoints[key] = {"calls": 0, "errors": 0, "latencies": []}
+        if rid is not None:
+            _count_by_rid(stat, event, rid, line_time, started, finished)
+            continue
+        # 没有rid的旧日志，同一个logger下同一个接口的请求和结果按先后顺序配对，并发时耗时只是近似值
+        queue = pending.setdefault((match.group(1), key), deque())
+        if event == b"request":
+            queue.append(line_time)
+            continue
+        stat["calls"] += 1
+        if event in ERROR_EVENTS:
+            stat["errors"] += 1
+        if queue:
+            stat["latencies"].append((line_time - queue.popleft()).total_seconds())
+    return result
+
+
+def merge(results):
+    summary = {"files": 0, "lines": 0, "first": None, "last": None, "endpoints": {}}
+    for result in results:
+        summary["files"] += 1
+        summary["lines"] += result["lines"]
+        if result["first"] is not None:
+            if summary["first"] is None or result["first"] < summary["first"]:
+                summary["first"] = result["first"]
+            if summary["last"] is None or result["last"] > summary["last"]:
+                summary["last"] = result["last"]
+        for key, stat in result["endpoints"].items():
+            total = summary["endpoints"].setdefault(key, {"calls": 0, "errors": 0, "latencies": []})
+            total["calls"] += stat["calls"]
+            total["errors"] += stat["errors"]
+            total["latencies"].extend(stat["latencies"])
+    return summary
+
+
+def analyze(filename, start_time=None, end_time=None, processes=None):
+    """
+    desc: 并行分析整组滚动日志
+    param: <filename> 当前写入的日志文件名
+           <start_time>/<end_time> datetime，只统计这个时间范围内的日志
+           <processes> 进程数，默认cpu个数
+    return: merge后的统计结果
+    """
+    tasks = [(path, start_time, end_time) for path in rotated_files(filename)]
+    if not tasks:
+        return merge([])
+    if processes == 1 or len(tasks) == 1:
+        return merge(map(analyze_file, tasks))
+    pool = Pool(processes)
+    try:
+        return merge(pool.imap_unordered(analyze_file, tasks))
+    finally:
+        pool.close()
+        pool.join()
+
+
+def _percentile(values, percent):
+    if not values:
+        return 0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * percent))]
+
+
+def report(summary):
+    lines = ["files: %d, lines: %d, range: %s ~ %s" % (summary["files"], summary["lines"],
+                                                       summary["first"], summary["last"]),
+             "%-6s %8s %8s %8s %8s %8s %8s  %s" % ("method", "calls", "errors", "err%", "avg(s)", "p95(s)",
+                                                  "max(s)", "url")]
+    endpoints = sorted(summary["endpoints"].items(), key=lambda item: item[1]["calls"], reverse=True)
+    for (method, url), stat in endpoints:
+        latencies = stat["latencies"]
+        lines.append("%-6s %8d %8d %7.1f%% %8.3f %8.3f %8.3f  %s" % (
+            method, stat["calls"], stat["errors"],
+            100.0 * stat["errors"] / stat["calls"] if stat["calls"] else 0,
+            sum(latencies) / len(latencies) if latencies else 0,
+            _percentile(latencies, 0.95), max(latencies) if latencies else 0, url))
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="analyze rotated log.Logger files")
+    parser.add_argument("filename", help="current log file, rotated files are found automatically")
+    parser.add_argument("--start", help="start time, %s" % TIME_FORMAT.replace("%", "%%"))
+    parser.add_argument("--end", help="end time, %s" % TIME_FORMAT.replace("%", "%%"))
+    parser.add_argument("-j", "--processes", type=int, default=None, help="worker processes")
+    args = parser.parse_args()
+    start_time = datetime.datetime.strptime(args.start, TIME_FORMAT) if args.start else None
+    end_time = datetime.datetime.strptime(args.end, TIME_FORMAT) if args.end else None
+    print(report(analyze(args.filename, start_time, end_time, args.processes)))
+
+
+if __name__ == "__main__":
+    main()
@@ -7,15 +7,178 @@
 
 """
 
+import time
+import random
+import threading
+
 import pymongo
 from pymongo import client_session
 
 
+def _query_shape(query):
+    """把查询条件中的值替换掉，只保留结构，相同结构的查询归为一类"""
+    if isinstance(query, dict):
+        return dict((k, _query_shape(v) if k.startswith("$") or isinstance(v, dict) else 1)
+                    for k, v in sorted(query.items()))
+    if isinstance(query, (list, tuple)):
+        return [_query_shape(v) for v in query[:1]]
+    return 1
+
+
+def _has_collscan(plan):
+    if isinstance(plan, dict):
+        if plan.get("stage") == "COLLSCAN":
+            return True
+        return any(_has_collscan(v) for v in plan.values())
+    if isinstance(plan, list):
+        return any(_has_collscan(v) for v in plan)
+    return False
+
+
+class _ProfiledCursor(object):
+    """
+    被采样的find游标，累计遍历(从服务端取数据)的耗时，遍历结束或者close时记录
+    """
+
+    def __init__(self, profiler, coll, query, cursor):
+        self._profiler = profiler
+        self._coll = coll
+        self._query = query
+        self._cursor = cursor
+        self._elapsed = 0
+        self._recorded = False
+
+    def _finish(self):
+        if not self._recorded:
+            self._recorded = True
+            self._profiler.finish(self._coll, "find", self._query, self._elapsed * 1000)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        start = time.time()
+        try:
+            doc = next(self._cursor)
+        except StopIteration:
+            # 结束遍历的这次取数据也要计时，没有结果的全表扫描耗时都在这里
+            self._elapsed += time.time() - start
+            self._finish()
+            raise
+        self._elapsed += time.time() - start
+        return doc
+
+    next = __next__
+
+    def close(self):
+        self._finish()
+        return self._cursor.close()
+
+    # 特殊方法不会经过__getattr__，需要显式转发
+    def __enter__(self):
+        self._cursor.__enter__()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self._finish()
+        return self._cursor.__exit__(exc_type, exc_val, exc_tb)
+
+    def __getitem__(self, index):
+        result = self._cursor[index]
+        # 切片返回的还是同一个游标
+        return self if result is self._cursor else result
+
+    def __getattr__(self, item):
+        attr = getattr(self._cursor, item)
+        if not callable(attr):
+            return attr
+
+        def call(*args, **kwargs):
+            result = attr(*args, **kwargs)
+            # sort/limit等链式调用返回的还是同一个游标，继续包装
+            return self if result is self._cursor else result
+        return call
+
+
+class MongoProfiler(object):
+    """
+    对通过MongoConn.__getattr__调用的集合操作采样，记录耗时，慢查询执行explain并标记全表扫描
+    sample_rate: 采样比例，0~1
+    slow_ms: 超过多少毫秒算慢查询
+    """
+    operations = ("find", "find_one", "count_documents", "update_one", "update_many",
+                  "delete_one", "delete_many", "find_one_and_update", "aggregate")
+
+    def __init__(self, sample_rate=0.1, slow_ms=100):
+        self.sample_rate = sample_rate
+        self.slow_ms = slow_ms
+        # {(集合, 操作, 查询结构): 统计}
+        self.stats = {}
+        self.lock = threading.Lock()
+
+    def wrap(self, coll, op, func):
+        def profiled(*args, **kwargs):
+            if random.random() >= self.sample_rate:
+                return func(*args, **kwargs)
+            query = args[0] if args else kwargs.get("filter", kwargs.get("pipeline", {}))
+            if op == "find":
+                # find返回的游标是惰性的，在遍历游标时计时
+                return _ProfiledCursor(self, coll, query, func(*args, **kwargs))
+            start = time.time()
+            result = func(*args, **kwargs)
+            self.finish(coll, op, query, (time.time() - start) * 1000)
+            return result
+        return profiled
+
+    def finish(self, coll, op, query, duration):
+        """记录一次采样，慢查询用queryPlanner执行explain查看执行计划"""
+        explain = None
+        if duration >= self.slow_ms and op != "aggregate":
+            try:
+                explain = coll.database.command("explain", {"find": coll.name, "filter": query},
+                                                verbosity="queryPlanner")
+            except Exception:
+                pass
+        self.record(coll, op, query, duration, explain)
+
+    def record(self, coll, op, query, duration, explain=None):
+        key = (coll.full_name, op, str(_query_shape(query)))
+        collscan = explain is not None and _has_collscan(explain.get("queryPlanner", {}).get("winningPlan"))
+        with self.lock:
+            stat = self.stats.get(key)
+            if stat is None:
+                stat = self.stats[key] = {"count": 0, "total_ms": 0, "max_ms": 0, "slow": 0, "collscan": False}
+            stat["count"] += 1
+            stat["total_ms"] += duration
+            stat["max_ms"] = max(stat["max_ms"], duration)
+            if duration >= self.slow_ms:
+                stat["slow"] += 1
+            stat["collscan"] = stat["collscan"] or collscan
+
+    def report(self):
+        """
+        return: 按最大耗时排序的统计 [{"coll", "op", "shape", "count", "avg_ms", "max_ms", "slow", "collscan"}]
+        """
+        with self.lock:
+            items = [(key, dict(stat)) for key, stat in self.stats.items()]
+        result = []
+        for (coll, op, shape), stat in items:
+            result.append({"coll": coll, "op": op, "shape": shape, "count": stat["count"],
+                           "avg_ms": stat["total_ms"] / stat["count"], "max_ms": stat["max_ms"],
+                           "slow": stat["slow"], "collscan": stat["collscan"]})
+        return sorted(result, key=lambda item: item["max_ms"], reverse=True)
+
+
 class MongoConn(object):
     """
     for mongodb
     """
     sep = ":"
+    # 声明每个集合的索引，启动时调用ensure_indexes创建
+    # {"db:coll": [([("field", 1)], {"unique": True}),,,]}
+    indexes = {}
+    _ensured = set()
+    _ensure_lock = threading.Lock()
 
     def __init__(self, conf=None):
         #uri = 'mongodb://{username}:{password}@{host}:{port}/'.format(**conf)
@@ -23,6 +186,55 @@ class MongoConn(object):
         self.client = pymongo.MongoClient(uri)
         self.db = None
         self.coll = None
+        self.profiler = None
+
+    @classmethod
+    def declare_index(cls, coll_name, keys, **options):
+        """
+        desc: 声明集合的索引
+        param: <coll_name> db:coll
+               <keys> 与pymongo create_index一致，字段名或者[(字段, 方向)]
+               <options> create_index的其他参数，比如unique、expireAfterSeconds
+        """
+        cls.indexes.setdefault(coll_name, []).append((keys, options))
+
+    def ensure_indexes(self, block=False):
+        """
+        desc: 创建声明的索引，每个索引在进程内只创建一次，重复调用是幂等的
+        param: <block> False 在后台线程中创建，不阻塞启动
+        return: 后台线程 或者 None
+        """
+        def run():
+            for coll_name, specs in list(self.indexes.items()):
+                coll = self.get_coll(coll_name)
+                for keys, options in specs:
+                    key = (coll_name, str(keys), str(sorted(options.items())))
+                    with MongoConn._ensure_lock:
+                        if key in MongoConn._ensured:
+                            continue
+                        MongoConn._ensured.add(key)
+                    try:
+                        coll.create_index(keys, **dict({"background": True}, **options))
+                    except Exception:
+                        with MongoConn._ensure_lock:
+                            MongoConn._ensured.discard(key)
+                        raise
+
+        if block:
+            run()
+            return None
+        thread = threading.Thread(target=run, name="mongo-ensure-indexes")
+        thread.daemon = True
+        thread.start()
+        return thread
+
+    def enable_profiler(self, sample_rate=0.1, slow_ms=100):
+        """
+        desc: 开启查询采样，之后通过conn.find(...)等__getattr__转发的操作会被记录
+        return: MongoProfiler实例，调用report()查看统计
+        """
+        self.profiler = MongoProfiler(sample_rate=sample_rate, slow_ms=slow_ms)
+        return self.profiler
 
     def close(self):
         try:
@@ -91,5 +303,9 @@ class MongoConn(object):
         return self.coll
 
     def __getattr__(self, item, *args, **kwargs):
-        return getattr(self.coll, item, *args, **kwargs)
+        attr = getattr(self.coll, item, *args, **kwargs)
+        profiler = self.__dict__.get("profiler")
+        if profiler is not None and item in MongoProfiler.operations:
+            return profiler.wrap(self.coll, item, attr)
+        return attr
 
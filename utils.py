@@ -6,6 +6,8 @@ import smtplib
 import multiprocessing
 import logger
 
+from circuit_breaker import get_breaker
+
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 from email.mime.image import MIMEImage
@@ -13,7 +15,7 @@ from email.mime.image import MIMEImage
 
 def send_mail(smtp_server, from_addr, to_addr, port,
               username, password, subject, message, message_type="plain",
-              image=None, attach=None, logger=None):
+              image=None, attach=None, logger=None, suppressor=None):
     """
     desc: 对标准smtplib发送邮件的作了封装，进行了一些错误处理
     param: <smtp_server> smtp 发送服务器的地址
@@ -28,9 +30,47 @@ def send_mail(smtp_server, from_addr, to_addr, port,
            <image> 图片
            <attach> 附件
            <logger> 日志实例
-    return: True 发送成功
+           <suppressor> 告警抑制实例(alert_suppress.AlertSuppressor)，窗口期内相同邮件只发送一次
+    return: True 发送成功(或已被其他进程发送)
             False 发送失败
+    raise: circuit_breaker.CircuitOpenError smtp服务连续失败已熔断
     """
+    fp = None
+    if suppressor is not None:
+        # 只有开启告警抑制时才需要alert_suppress(依赖pymongo)
+        from alert_suppress import fingerprint
+        fp = fingerprint(from_addr, to_addr, subject, message)
+        if not suppressor.acquire(fp):
+            if logger:
+                logger.info("Mail suppressed: %s -- %s" % (subject, fp))
+            return True
+
+    breaker = get_breaker("smtp://%s:%s" % (smtp_server, port))
+    try:
+        breaker.before_call()
+    except Exception:
+        if fp is not None:
+            suppressor.release(fp)
+        raise
+
+    try:
+        sent = _send_mail(smtp_server, from_addr, to_addr, port, username, password,
+                          subject, message, message_type, image, attach, logger, breaker)
+    except Exception:
+        breaker.record_failure()
+        if fp is not None:
+            suppressor.release(fp)
+        raise
+    if not sent:
+        if fp is not None:
+            suppressor.release(fp)
+        return False
+    return True
+
+
+def _send_mail(smtp_server, from_addr, to_addr, port,
+               username, password, subject, message, message_type,
+               image, attach, logger, breaker):
     try:
         smtp = smtplib.SMTP_SSL(smtp_server, port, timeout=10)
         smtp.login(username, password)
@@ -38,10 +78,12 @@ def send_mail(smtp_server, from_addr, to_addr, port,
         if logger:
             logger.error("socket.gaierror: [Errno -2] Name or service not known, "
                          "maybe your network has something wrong")
+        breaker.record_failure()
         return False
     except smtplib.SMTPAuthenticationError:
         if logger:
             logger.error("email authentication error, please check your email name and password")
+        breaker.record_success()
         return False
 
     multipart_mail = MIMEMultipart("related")
@@ -72,11 +114,14 @@ def send_mail(smtp_server, from_addr, to_addr, port,
     except smtplib.SMTPRecipientsRefused as e:
         if logger:
             logger.error("Send mail failure: %s" % e)
+        breaker.record_success()
         return False
     except smtplib.SMTPServerDisconnected as e:
         if logger:
             logger.error("send mail failure: %s" % e)
+        breaker.record_failure()
         return False
 
     smtp.close()
+    breaker.record_success()
     return True